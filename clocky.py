@@ -7,9 +7,11 @@
 # See: https://github.com/pimoroni/rainbow-hat
 #
 # Uses a state machine that passes around state by class type.
+# Settings are read from clocky.ini (next to this script) and reloaded when it changes.
 #	Start at clock mode: A to go into Nap
 #						 B to enter main menu mode
-#						 C to enter a "timeout" mode (1 minute countdown)
+#						 C to start a "timeout" timer (2 minute countdown, see [timers])
+#	Timers and daily alarms run in the background and preempt any mode when due.
 # 
 # MISC:
 # Sunset: https://michelanders.blogspot.com/2010/12/calulating-sunrise-and-sunset-in-python.html
@@ -34,11 +36,16 @@
 #       /______________\  
 #
 # ============================================================================
+import collections
 import colorsys
+import configparser
+import ctypes
+import heapq
 import os
 import math
 import rainbowhat as rh			# pylint: disable=import-error
 import random
+import sys
 import time
 
 
@@ -46,17 +53,23 @@ import time
 #	Constants
 MAX_LED_DISPLAY_WIDTH = 4	# Number of led display characters
 MAX_LEDS = 7				# Number of multicolored LEDs in the "rainbow"
+FRAME_DELAY_S = 0.01		# Seconds per frame of the main loop (unless a mode asks for faster)
+MIN_FRAME_SLEEP_S = 0.001	# Always sleep at least this long per frame, so the CPU is never pinned
 
 
 # ----------------------------------------------------------------------------
 # Buttons on the the RainbowHAT (static class)
 class Buttons():
-	led_a	 :int=0
-	led_b	 :int=0
-	led_c	 :int=0
-	trigger_a:bool = False
-	trigger_b:bool = False
-	trigger_c:bool = False
+	__slots__ = ('led_a','led_b','led_c','trigger_a','trigger_b','trigger_c')
+	led_a	 :int
+	led_b	 :int
+	led_c	 :int
+	trigger_a:bool
+	trigger_b:bool
+	trigger_c:bool
+	def __init__(self):
+		self.led_a = self.led_b = self.led_c = 0
+		self.trigger_a = self.trigger_b = self.trigger_c = False
 	def lower_triggers(self):
 		self.trigger_a = self.trigger_b = self.trigger_c = False
 
@@ -68,6 +81,10 @@ isRunning:bool = True	# Is main loop running?
 ms_start :float= None	# float of when a time counter started
 ms_now	 :float= None	# float of time now
 localtime:time = None	# The current time
+localtime_sec:int= None	# Second (since epoch) that localtime was built for
+settings = None			# The active Settings; replaced whole when the config file changes
+config_watcher = None	# ConfigWatcher for the config file (set up in main)
+display_due:float= 0	# monotonic time the LED display is next updated
 
 
 # ----------------------------------------------------------------------------
@@ -79,13 +96,13 @@ def GetClassName( instance ):
 	return instance.__class__.__name__
 
 # Bounce back and forth on a sub string within a given (LED display) width.
+# Sub strings are sliced once up front so stepping through them allocates nothing.
 def range_sub_string( msg:str, width:int = MAX_LED_DISPLAY_WIDTH):
 	size:int = len(msg)	
+	sub_strings:list = [msg[index:index+width] for index in range(max(1,size-width+1))]
 	while True:
-		index:int = -1
-		while index < size-width:
-			index += 1
-			yield msg[index:index+width]		
+		for sub_string in sub_strings:
+			yield sub_string
 
 # degree is 0 to 360
 # returns smooth 0 to 1 based on degree
@@ -101,39 +118,57 @@ def get_0to0_from_percent( percent:float ):
 
 # i is pixel
 # sec is # of second 0-59
-# returns [r,g,b,brightness]
-def get_sin_shine( i:int, sec:int ):
+# out is a preallocated [r,g,b,brightness] that is written in place
+# returns out
+def get_sin_shine( i:int, sec:int, out:list ):
 	degree = ((sec*6) + (i*231)) % 360
 	amt = 50 * get_0to1_from_degree(degree)
-	return [amt, amt, 0, 0.0]
+	out[0] = amt
+	out[1] = amt
+	out[2] = 0
+	out[3] = 0.0
+	return out
+
+# Add a [r,g,b,brightness] value to a single pixel, in place
+def pix_add(pixel:list, value:list):
+	pixel[0] += value[0]
+	pixel[1] += value[1]
+	pixel[2] += value[2]
+	pixel[3] += value[3]
 
-# Fill an array of red,green,blue,brightness values
+# Add to an array of red,green,blue,brightness values, in place
 def pix_array_add(array,r,g,b,brightness=0.05):
-	size = len(array)
-	for i in range(size):
-		array[i] = [sum(n) for n in zip(*[array[i], [r,g,b,brightness]])]
+	for i in range(len(array)):
+		pixel = array[i]
+		pixel[0] += r
+		pixel[1] += g
+		pixel[2] += b
+		pixel[3] += brightness
 
 # Blend two red,green,blue,brightness arrays with a weighted value
+# Result is written in place to a_array (which is also returned)
 def pix_array_weighted_blend( a_array:list, b_array:list, a_weight:float ):
 	size = len(a_array)
 	assert(len(b_array) == size),"Mismatched array sizes!"
-	out = []
-	for i in range(size):		
-		out.append([ 
-			(a_weight*b_array[i][0]) + ((1-a_weight)*a_array[i][0]),
-			(a_weight*b_array[i][1]) + ((1-a_weight)*a_array[i][1]),
-			(a_weight*b_array[i][2]) + ((1-a_weight)*a_array[i][2]),
-			(a_weight*b_array[i][3]) + ((1-a_weight)*a_array[i][3])])
-	return out
+	b_weight = 1-a_weight
+	for i in range(size):
+		a = a_array[i]
+		b = b_array[i]
+		a[0] = (a_weight*b[0]) + (b_weight*a[0])
+		a[1] = (a_weight*b[1]) + (b_weight*a[1])
+		a[2] = (a_weight*b[2]) + (b_weight*a[2])
+		a[3] = (a_weight*b[3]) + (b_weight*a[3])
+	return a_array
+
+# [r,g,b,brightness] added to a pixel when a night star twinkles over it
+NIGHT_TWINKLE_PIXEL = (0, -10, 10, 0.0)
 
 # star is virtual star index # (0 to n)
 # sec is # of second 0-59
 # size is # of (virtual) pixels to work with
-# returns index,[r,g,b,brightness] (where index is 0 to size-1)
+# returns index (0 to size-1) for the star; pixel value is NIGHT_TWINKLE_PIXEL
 def get_night_twinkle( star:int, sec:int, size:int ):
-	amt = 10
-	index = int((sec*0.2)*(star+1)) % size
-	return index, [0, -10, amt, 0.0]
+	return int((sec*0.2)*(star+1)) % size
 
 def clamp(n,a,b):
 	return max(a,min(n,b))
@@ -185,32 +220,89 @@ def set_display4( segment_0:int, segment_1:int, segment_2:int, segment_3:int ):
 
 
 # ----------------------------------------------------------------------------
+# Each pixel is its own [r,g,b,brightness] list so it can be rewritten in place
+# every frame; allocate buffers once and reuse them.
 class PixelBuffer():
-	def __init__(self,size,rgbi_default=[0,0,0,0]):
+	__slots__ = ('size','buffer')
+	def __init__(self,size,rgbi_default=(0,0,0,0)):
 		self.size :int = size
-		self.buffer :list = [None] * size
-		for i in range(size):
-			self.buffer[i] = rgbi_default
+		self.buffer :list = [list(rgbi_default) for i in range(size)]
 	def __len__(self):					return self.size
 	def __getitem__(self, key):			return self.buffer[key]
-	def __setitem__(self, key,value):	self.buffer[key] = value
-	def blend(self,weight:float, target:'PixelBuffer') -> list:
+	def __setitem__(self, key,value):	self.buffer[key][:] = value
+	def fill(self,r,g,b,brightness):
+		for pixel in self.buffer:
+			pixel[0] = r
+			pixel[1] = g
+			pixel[2] = b
+			pixel[3] = brightness
+	def blend(self,weight:float, target:'PixelBuffer') -> 'PixelBuffer':
 		assert(self.size == target.size),"Mismatched array sizes!"
-		mixed :list = []
-		for i in range(self.size):		
-			mixed.append([ 
-				(weight * target.buffer[i][0]) + ((1-weight) * self.buffer[i][0]),
-				(weight * target.buffer[i][1]) + ((1-weight) * self.buffer[i][1]),
-				(weight * target.buffer[i][2]) + ((1-weight) * self.buffer[i][2]),
-				(weight * target.buffer[i][3]) + ((1-weight) * self.buffer[i][3])])
-		return mixed		
+		pix_array_weighted_blend(self.buffer, target.buffer, weight)
+		return self
+
+# ----------------------------------------------------------------------------
+# Keeps full precision (float) r,g,b values for the rainbow and outputs them
+# with temporal dithering: the part lost when truncating to 0-255 is carried
+# to the next frame, so over many frames each LED averages its exact value.
+# Very dim colors (1 to 10 out of 255) fade smoothly instead of stepping,
+# as long as show() is called at a high refresh rate.
+class DitherBuffer():
+	__slots__ = ('size','pixels','errors')
+	def __init__(self,size):
+		self.size :int = size
+		self.pixels :list = [[0.0,0.0,0.0,0.0] for i in range(size)]	# r,g,b,brightness
+		self.errors :list = [[0.0,0.0,0.0] for i in range(size)]		# r,g,b carried error
+	def __len__(self):					return self.size
+	def __getitem__(self, key):			return self.pixels[key]
+
+	# Same arguments as rh.rainbow.set_pixel() so it can be a drop in target
+	def set_pixel(self,i,r,g,b,brightness):
+		pixel = self.pixels[i]
+		pixel[0] = clamp(r,0,255)
+		pixel[1] = clamp(g,0,255)
+		pixel[2] = clamp(b,0,255)
+		pixel[3] = brightness
+
+	# Output one frame to the rainbow LEDs (call rh.rainbow.show() after)
+	def show(self, dither:bool=True):
+		for i in range(self.size):
+			pixel = self.pixels[i]
+			if dither:
+				error = self.errors[i]
+				r = pixel[0] + error[0]
+				g = pixel[1] + error[1]
+				b = pixel[2] + error[2]
+				out_r = min(int(r),255)
+				out_g = min(int(g),255)
+				out_b = min(int(b),255)
+				error[0] = r - out_r
+				error[1] = g - out_g
+				error[2] = b - out_b
+				rh.rainbow.set_pixel(i, out_r, out_g, out_b, pixel[3])
+			else:
+				rh.rainbow.set_pixel(i, pixel[0], pixel[1], pixel[2], pixel[3])
+
+# ----------------------------------------------------------------------------
+# Preallocated frame buffers; the render path writes into these in place.
+VIRTUAL_LEDS = 12							# maximum virtual LEDs for time of day
+time_pix			:PixelBuffer = PixelBuffer(VIRTUAL_LEDS)
+time_night_pix		:PixelBuffer = PixelBuffer(VIRTUAL_LEDS)	# buffer for night stars
+time_sunsetrise_pix	:PixelBuffer = PixelBuffer(VIRTUAL_LEDS)
+time_shine_pixel	:list = [0,0,0,0.0]
+timer_rgb			:list = [0,0,0]			# countdown color for a timer's progress
+clock_dither		:DitherBuffer = DitherBuffer(MAX_LEDS)	# time of day colors, full precision
+
+# Rainbow colors cycled through by offset, one (r,g,b) per step
+RAINBOW_OFFSET_COLORS :tuple = tuple(
+	tuple(int(c * 255) for c in colorsys.hsv_to_rgb(step / (MAX_LEDS*2), 1.0, 0.3))
+	for step in range(MAX_LEDS*2))
 
 # ----------------------------------------------------------------------------
 # Fill rainbow LEDs with colors based on offset
 def set_rainbow_based_on_offset( offset:int ):
 	for i in range(MAX_LEDS):	
-		h =	(((i+offset)%(MAX_LEDS*2)) / (MAX_LEDS*2))
-		r, g, b = [int(c * 255) for c in colorsys.hsv_to_rgb(h, 1.0, 0.3)]
+		r, g, b = RAINBOW_OFFSET_COLORS[(i+offset)%(MAX_LEDS*2)]
 		rh.rainbow.set_pixel(i,r,g,b,0.5)
 
 # ----------------------------------------------------------------------------
@@ -218,32 +310,31 @@ def set_rainbow_based_on_offset( offset:int ):
 #	time, of day
 #	sunrise, when a sunrise should start mixing in to morning
 #	sunset, when a sunset should start mixing in to night
-def set_rainbow_based_on_time( time, sunrise=6, sunset=19):
+#	rainbow, where pixels are set (rh.rainbow or a DitherBuffer)
+def set_rainbow_based_on_time( time, sunrise=6, sunset=19, rainbow=rh.rainbow):
 	hour 		= time.tm_hour
 	minute 		= time.tm_min
 	sec 		= time.tm_sec
 	
-	max_led 		:int  = 7							# maximum true LEDs
-	size 			:int  = 12							# maximum virtual LEDs	
-	pix 			:PixelBuffer = PixelBuffer(size, [0,1,0,0.05])
-	night_pix 		:PixelBuffer = PixelBuffer(size, [1,0,2,0.05])	# buffer for night stars
-	sunsetrise_pix	:PixelBuffer = PixelBuffer(size, [0,0,0,0.05])
+	max_led 		:int  = MAX_LEDS					# maximum true LEDs
+	size 			:int  = VIRTUAL_LEDS				# maximum virtual LEDs	
+	pix 			:PixelBuffer = time_pix
+	night_pix 		:PixelBuffer = time_night_pix		# buffer for night stars
+	sunsetrise_pix	:PixelBuffer = time_sunsetrise_pix
 	wakeup_display   :bool = False
 
-	for i in range(size):
-		sunsetrise_pix[i] = [5*(1+(minute%5)),0,0,0.05]
+	sunsetrise_pix.fill(5*(1+(minute%5)),0,0,0.05)
 
 	# Start dim, slightly green (grass!)	
+	pix.fill(0,1,0,0.05)
 	pix_array_add(pix,0,1,0,0.05)
-	for i in range(size):
-		if i < max_led:
-			shine_pixel = get_sin_shine(i,sec)
-			pix[i] = [sum(n) for n in zip(*[pix[i], shine_pixel])]
+	for i in range(max_led):
+		pix_add(pix[i], get_sin_shine(i,sec,time_shine_pixel))
 
+	night_pix.fill(1,0,2,0.05)
 	pix_array_add(night_pix,1,0,2,0.05)
 	for star in range(5):
-		i, pixel = get_night_twinkle(star,sec,size)
-		night_pix[i] = [sum(n) for n in zip(*[night_pix[i], pixel])]
+		pix_add(night_pix[get_night_twinkle(star,sec,size)], NIGHT_TWINKLE_PIXEL)
 
 	blend_amount = 0.0
 	sunsetrise_amount = 0.0
@@ -265,51 +356,73 @@ def set_rainbow_based_on_time( time, sunrise=6, sunset=19):
 		# "render" out to LED buffer
 		for i in range(max_led):
 			brightness = clamp(minute+5,1,30)/60	# 0.08 to 0.5 brightness
-			rh.rainbow.set_pixel(i, random.randint(0,32), random.randint(0,32), random.randint(0,32), brightness)	# index,r,g,b,a
+			rainbow.set_pixel(i, random.randint(0,32), random.randint(0,32), random.randint(0,32), brightness)	# index,r,g,b,a
 	else:
-		pix = pix_array_weighted_blend(pix, night_pix, blend_amount)	
-		pix = pix_array_weighted_blend(pix, sunsetrise_pix, sunsetrise_amount)		
+		pix.blend(blend_amount, night_pix)
+		pix.blend(sunsetrise_amount, sunsetrise_pix)
 		#print("h: ",localtime.tm_hour, "  m: ", localtime.tm_min, "  blend: ",blend_amount,"   sunset: ", sunsetrise_amount)
 		# "render" out to LED buffer
-		for i in range(size):
-			if i < max_led:
-				rh.rainbow.set_pixel(i, pix[i][0], clamp(pix[i][1],0,255), clamp(pix[i][2],0,255), clamp(pix[i][3],0,255))
+		for i in range(max_led):
+			pixel = pix[i]
+			rainbow.set_pixel(i, pixel[0], clamp(pixel[1],0,255), clamp(pixel[2],0,255), clamp(pixel[3],0,255))
 
 # ----------------------------------------------------------------------------
-# For a a given seconds (120 to 0) and a pixel index, return an RGB value for that pixel
-# returns [red,green,blue] with values 0-255
-def get_countdown_color( seconds:int, index:int ):	
-	durration = 120
-	step = int(durration / MAX_LEDS)
+# For a a given seconds (0 to durration) and a pixel index, return an RGB value for that pixel
+# out is a preallocated [red,green,blue] that is written in place
+# returns out with values 0-255
+def get_countdown_color( seconds:int, index:int, out:list, durration:int = 120 ):	
+	step = max(1, int(durration / MAX_LEDS))
 	active_pixel = int(seconds/step)
 	if index > active_pixel:
-		return [30,0,0]				# red stop
+		out[0] = 30; out[1] = 0; out[2] = 0		# red stop
 	elif index < active_pixel:
-		return [2,10,2]				# green go!	
-	h =	((seconds%step) / step)
-	r, g, b = [int(c * 255) for c in colorsys.hsv_to_rgb(h, 1.0, 0.3)]
-	return [r,g,b]
+		out[0] = 2; out[1] = 10; out[2] = 2		# green go!	
+	else:
+		r, g, b = colorsys.hsv_to_rgb((seconds%step) / step, 1.0, 0.3)
+		out[0] = int(r * 255); out[1] = int(g * 255); out[2] = int(b * 255)
+	return out
+
+# ----------------------------------------------------------------------------
+# Show how far along a (background) timer is on the rainbow LEDs
+def set_rainbow_based_on_timer( timer:'Timer' ):
+	now = time.monotonic()
+	seconds :int = int(timer.get_elapsed(now))
+	durration :int = int(timer.get_durration())
+	for i in range( MAX_LEDS ):
+		get_countdown_color(seconds,i,timer_rgb,durration)
+		rh.rainbow.set_pixel(6-i, timer_rgb[0], timer_rgb[1], timer_rgb[2], 0.3)
 
 # ----------------------------------------------------------------------------
+# Nice little slightly-scrambled rainbow table
+BINARY_COLORS:tuple = (
+	(25,0,0),
+	(15,15,0),
+	(0,15,15),
+	(0,0,25),
+	(15,0,15),
+	(20,10,0),
+	(0,25,0),
+	(0,10,20),
+	(10,0,20),
+	(20,0,10)
+)
+
 # Return pixel colors for 0 and 1 respectively based on value
-# returns two sets of [r,g,b]; first for off pixels, second for on pixels
+# returns two sets of (r,g,b); first for off pixels, second for on pixels
 def get_binary_colors( value:int ):	
-	# Nice little slightly-scrambled rainbow table
-	colors:list = [		
-		[25,0,0],
-		[15,15,0],
-		[0,15,15],
-		[0,0,25],
-		[15,0,15],
-		[20,10,0],
-		[0,25,0],
-		[0,10,20],
-		[10,0,20],
-		[20,0,10]
-	]
-	off_set = int(value / 128) % len(colors)
-	on_set = int((value+128) / 128) % len(colors)
-	return colors[off_set], colors[on_set]
+	off_set = int(value / 128) % len(BINARY_COLORS)
+	on_set = int((value+128) / 128) % len(BINARY_COLORS)
+	return BINARY_COLORS[off_set], BINARY_COLORS[on_set]
+
+# ----------------------------------------------------------------------------
+# Show binary LEDs based on the bits of num, least significant bit first.
+def set_rainbow_based_on_binary( num:int ):
+	off_color, on_color = get_binary_colors(num)
+	for index in range(MAX_LEDS):
+		if (num >> index) & 1:
+			rh.rainbow.set_pixel(index, on_color[0], on_color[1], on_color[2], 0.4)				
+		else:
+			rh.rainbow.set_pixel(index, off_color[0], off_color[1], off_color[2], 0.1)
 
 # ----------------------------------------------------------------------------
 # beep beep beeeeep
@@ -341,7 +454,29 @@ def play_tune():
 				return
 
 # ----------------------------------------------------------------------------
+# Formats the 12 hour clock for the LED display, but only when the minute changes.
+class ClockText():
+	__slots__ = ('minute_of_day','text')
+	def __init__(self):
+		self.minute_of_day :int = -1
+		self.text :str = "    "
+
+	def get(self, localtime):
+		minute_of_day = (localtime.tm_hour * 60) + localtime.tm_min
+		if minute_of_day != self.minute_of_day:
+			self.minute_of_day = minute_of_day
+			twelvehour = (localtime.tm_hour % 12) if ((localtime.tm_hour % 12)>0) else 12
+			self.text = str(twelvehour).rjust(2," ") + str(localtime.tm_min).rjust(2,"0")
+		return self.text
+
+clock_text :ClockText = ClockText()
+
+# ----------------------------------------------------------------------------
+# Modes (and their subclasses) declare __slots__ so no per-instance dict is made.
 class Mode(object):
+	__slots__ = ('__led_name','__full_name','__enter_time','skip_preview',
+				 'ModeA','ModeB','ModeC','FuncA','FuncB','FuncC')
+
 	def __init__(self, led_name:str, full_name:str=None):
 		#print("Mode.__init__:",led_name)
 		self.__led_name = led_name			# Name that fits in LED display
@@ -358,6 +493,7 @@ class Mode(object):
 	def get_led_name(self): 		return self.__led_name
 	def get_full_name(self): 		return self.__full_name
 	def get_skip_preview(self): 	return self.skip_preview
+	def get_frame_delay_s(self):	return FRAME_DELAY_S		# How often run() is called
 
 	# Set the modes (can be None) that are switched to via A,B,and C buttons
 	def set_abc_modes(self, mode_a=None, mode_b=None, mode_c=None):
@@ -376,6 +512,10 @@ class Mode(object):
 	def enter(self, old_mode):
 		pass
 
+	# Mode is active again after being preempted (e.g. by an alarm)
+	def resume(self):
+		pass
+
 	# About to exit this mode, prepare properties (if any) to pass to next mode
 	def exiting(self, new_mode):
 		pass
@@ -394,11 +534,14 @@ class Mode(object):
 
 # ----------------------------------------------------------------------------
 class StateMachine(object):
+	__slots__ = ('mode','last_time','changed_mode_delay_ms','force_skip_preview','suspended')
+
 	def __init__(self):
 		self.mode = None					# The active mode
 		self.last_time = 0					# Use to determine call delta
 		self.changed_mode_delay_ms = 1000	# How much time to display mode's name		
 		self.force_skip_preview = False
+		self.suspended :list = []			# Modes preempted, waiting to resume
 
 	# Change m odes, passing any necessary information between them
 	def change_mode(self, new_mode_class ):
@@ -412,6 +555,21 @@ class StateMachine(object):
 			self.mode.enter( old_mode )
 		self.force_skip_preview = (GetClassName(old_mode) == "MenuMode")
 
+	# Interrupt the active mode with another; it keeps its state until resumed
+	def preempt_mode(self, new_mode_class ):
+		new_mode:Mode = new_mode_class()
+		old_mode:Mode = self.mode
+		self.suspended.append( old_mode )
+		self.mode = new_mode
+		self.mode.pre_enter( old_mode )
+		self.mode.enter( old_mode )
+		self.force_skip_preview = False
+
+	# Go back to the most recently preempted mode, as it was
+	def resume_mode(self):
+		self.mode = self.suspended.pop()
+		self.force_skip_preview = True
+		self.mode.resume()
 
 	# Once per frame update the mode...
 	def run(self):
@@ -441,18 +599,130 @@ class StateMachine(object):
 			if current_mode.ModeC != None: self.change_mode( current_mode.ModeC )
 
 
+# ----------------------------------------------------------------------------
+# A countdown timer or daily alarm. Timers use time.monotonic() values so they
+# are not affected by clock changes; alarms use time.time() (epoch) values so
+# they go off when the clock reads their time, even after NTP or DST changes.
+class Timer():
+	__slots__ = ('name','start','due','alarm_hour','alarm_minute')
+
+	def __init__(self, name:str, start:float, due:float, alarm_hour:int=None, alarm_minute:int=None):
+		self.name :str = name					# Shown on the LED display when it goes off
+		self.start :float = start
+		self.due :float = due
+		self.alarm_hour :int = alarm_hour		# Alarms re-arm for the same time each day
+		self.alarm_minute :int = alarm_minute
+
+	def is_alarm(self):					return self.alarm_hour != None
+	def get_durration(self):			return self.due - self.start
+	def get_elapsed(self, now:float):	return clamp(now - self.start, 0, self.get_durration())
+	def get_remaining(self, now:float):	return max(0, self.due - now)
+
+# Epoch time of the first hour:minute after a given epoch time.
+# Uses mktime() so days that are 23 or 25 hours long (DST) are handled.
+def get_next_alarm_time( hour:int, minute:int, after:float ) -> float:
+	day = time.localtime(after)
+	due :float = time.mktime((day.tm_year, day.tm_mon, day.tm_mday, hour, minute, 0, 0, 0, -1))
+	if due <= after:
+		due = time.mktime((day.tm_year, day.tm_mon, day.tm_mday + 1, hour, minute, 0, 0, 0, -1))
+	return due
+
+ALARM_LATE_S = 60		# An alarm this late was skipped over by the clock being set; don't sound it
+
+# ----------------------------------------------------------------------------
+# Priority queues of running countdown timers and daily alarms, soonest first.
+# next_due (monotonic) and next_alarm_due (epoch) are kept up to date so the
+# main loop only needs two comparisons.
+class Scheduler():
+	__slots__ = ('__timers','__alarms','__count','next_due','next_alarm_due','fired')
+
+	def __init__(self):
+		self.__timers :list = []				# heap of (due, count, Timer)
+		self.__alarms :list = []				# heap of (due, count, Timer)
+		self.__count :int = 0					# tie breaker; keeps equal due times in order
+		self.next_due :float = math.inf
+		self.next_alarm_due :float = math.inf
+		self.fired :Timer = None				# The timer or alarm that last went off
+
+	def __len__(self):		return len(self.__timers) + len(self.__alarms)
+
+	def __update_next_due(self):
+		self.next_due = self.__timers[0][0] if self.__timers else math.inf
+		self.next_alarm_due = self.__alarms[0][0] if self.__alarms else math.inf
+
+	def __push(self, heap:list, timer:Timer):
+		heapq.heappush(heap, (timer.due, self.__count, timer))
+		self.__count += 1
+		self.__update_next_due()
+		return timer
+
+	def add_timer(self, name:str, seconds:float) -> Timer:
+		now = time.monotonic()
+		return self.__push( self.__timers, Timer(name, now, now + seconds) )
+
+	# Arm an alarm for the first hour:minute after 'after' (default now)
+	def add_alarm(self, name:str, hour:int, minute:int, after:float=None) -> Timer:
+		now = time.time()
+		due = get_next_alarm_time(hour, minute, now if after == None else after)
+		return self.__push( self.__alarms, Timer(name, now, due, hour, minute) )
+
+	# Replace all daily alarms with a list of (name, hour, minute)
+	def set_alarms(self, alarms):
+		self.__alarms = []
+		self.__update_next_due()
+		for name, hour, minute in alarms:
+			self.add_alarm( name, hour, minute )
+
+	# Stop a timer (or alarm) before it goes off; False if it is not waiting
+	def cancel(self, timer:Timer) -> bool:
+		heap :list = self.__alarms if timer.is_alarm() else self.__timers
+		for entry in heap:
+			if entry[2] is timer:
+				heap.remove(entry)
+				heapq.heapify(heap)
+				self.__update_next_due()
+				return True
+		return False
+
+	# The countdown timer that will go off next (or None); alarms are not included
+	def soonest(self) -> Timer:
+		return self.__timers[0][2] if self.__timers else None
+
+	# Remove one timer or alarm that is due and keep it in 'fired'.
+	# now is time.monotonic(), now_epoch is time.time().
+	# Returns False if nothing is due, or the alarm due was skipped over by a clock change.
+	def fire_due(self, now:float, now_epoch:float) -> bool:
+		if self.__timers and self.__timers[0][0] <= now:
+			self.fired = heapq.heappop(self.__timers)[2]
+			self.__update_next_due()
+			return True
+		if self.__alarms and self.__alarms[0][0] <= now_epoch:
+			alarm :Timer = heapq.heappop(self.__alarms)[2]
+			# Re-arm from its own due time (not now) so it can't go off twice
+			is_late :bool = (now_epoch - alarm.due) > ALARM_LATE_S
+			self.add_alarm(alarm.name, alarm.alarm_hour, alarm.alarm_minute, now_epoch if is_late else alarm.due)
+			if is_late:
+				return False
+			self.fired = alarm
+			return True
+		return False
+
+
 # ----------------------------------------------------------------------------
 #   .----..-----. .--. .-----..----.    .-.  .-.  .--.  .----..-. .-..-..-. .-..----. 
 #  { {__-``-' '-'/ {} \`-' '-'} |__}    }  \/  { / {} \ | }`-'{ {_} |{ ||  \{ |} |__} 
 #  .-._} }  } { /  /\  \ } {  } '__}    | {  } |/  /\  \| },-.| { } }| }| }\  {} '__} 
 #  `----'   `-' `-'  `-' `-'  `----'    `-'  `-'`-'  `-'`----'`-' `-'`-'`-' `-'`----' 
 state_machine = StateMachine()
+scheduler = Scheduler()
 
 
 # ----------------------------------------------------------------------------
 # Startup sequence
 # Breaks the rules a bit to play animated sequence before main loop
 class StartMode(Mode):
+	__slots__ = ()
+
 	def __init__(self):
 		Mode.__init__(self,"HELO","Hello")
 
@@ -471,26 +741,43 @@ class StartMode(Mode):
 		state_machine.change_mode( ClockMode )
 
 # ----------------------------------------------------------------------------
+# Time of day colors are worked out at the normal frame rate, but are output
+# (dithered) at settings.refresh_hz so dim night and sunrise colors are smooth.
 class ClockMode(Mode):
+	__slots__ = ('next_compute',)
+
 	def __init__(self):
 		Mode.__init__(self,"CLOK","Clock")
+		self.next_compute :float = 0			# when to next work out the colors
 		self.set_abc_modes( NapMode, MenuMode, TimeoutMode )
 
 	def enter(self, old_mode):
 		Mode.enter(self, old_mode)
 
+	# Only dithered time of day colors gain anything from the high refresh rate
+	def get_frame_delay_s(self):
+		if settings.dither and scheduler.soonest() == None:
+			return settings.refresh_delay_s
+		return FRAME_DELAY_S
+
 	def run(self):
 		global localtime
-		twelvehour = (localtime.tm_hour % 12) if ((localtime.tm_hour % 12)>0) else 12
-		timestr = str(twelvehour).rjust(2," ") + str(localtime.tm_min).rjust(2,"0")
-		rh.display.print_str(timestr)							# set time on segemented display
+		rh.display.print_str(clock_text.get(localtime))		# set time on segemented display
 		rh.display.set_decimal(1, (localtime.tm_sec %2)==0 )	# blink decimal by the second		
-		set_rainbow_based_on_time( localtime )
+		timer :Timer = scheduler.soonest()
+		if timer != None:
+			set_rainbow_based_on_timer( timer )
+			return
+		now = time.monotonic()
+		if now >= self.next_compute:
+			self.next_compute = now + FRAME_DELAY_S
+			set_rainbow_based_on_time( localtime, settings.sunrise, settings.sunset, clock_dither )
+		clock_dither.show( settings.dither )
 
 # ----------------------------------------------------------------------------
 # Like clock mode but no animation for 2 hours; then auto back to clock mode.
 class NapMode(Mode):
-	two_hours_ms :int = (1000*60*60*2)
+	__slots__ = ()
 
 	def __init__(self):
 		Mode.__init__(self," NAP","Nap")
@@ -500,40 +787,97 @@ class NapMode(Mode):
 	def enter(self, old_mode):
 		rh.rainbow.set_all(0, 0, 1, 0.05)
 
+	def resume(self):
+		rh.rainbow.set_all(0, 0, 1, 0.05)
+
 	def run(self):
 		global localtime
-		twelvehour = (localtime.tm_hour % 12) if ((localtime.tm_hour % 12)>0) else 12
-		timestr = str(twelvehour).rjust(2," ") + str(localtime.tm_min).rjust(2,"0")
-		rh.display.print_str(timestr)							# set time on segemented display
+		rh.display.print_str(clock_text.get(localtime))		# set time on segemented display
 		rh.display.set_decimal(1, (localtime.tm_sec %2)==0 )	# blink decimal by the second				
-		if self.get_durration_ms() > NapMode.two_hours_ms:		# After 2 hours, change to clock
+		if self.get_durration_ms() > settings.nap_ms:		# After nap time (2 hours), change to clock
 			state_machine.change_mode( ClockMode )
 
 # ----------------------------------------------------------------------------
+# Starts a background timer (the first in settings.timers) and shows its
+# countdown. Leaving with B keeps the timer running; AlarmMode takes over when
+# it is done. A cancels it, C cancels it and starts the next one in the list.
 class TimeoutMode(Mode):
+	__slots__ = ('timer','timer_index','shown_seconds','seconds_str')
+
 	def __init__(self):
 		Mode.__init__(self,"Tout","Timeout")
 		self.skip_preview = False
-		self.is_tune_played :bool = False		
-		self.set_abc_modes( ClockMode, ClockMode, ClockMode )
+		self.timer :Timer = None
+		self.timer_index :int = 0				# Index into settings.timers
+		self.shown_seconds :int = -1			# seconds_str is only rebuilt when this changes
+		self.seconds_str :str = "    "
+		self.set_abc_funcs( self.cancel_timer, None, self.next_timer )
+		self.set_abc_modes( ClockMode, ClockMode, None )
+
+	def enter(self, old_mode):
+		self.start_timer()
+
+	def start_timer(self):
+		name, seconds = settings.timers[self.timer_index % len(settings.timers)]
+		self.timer = scheduler.add_timer( name, seconds )
+
+	def cancel_timer(self):
+		scheduler.cancel( self.timer )
+
+	def next_timer(self):
+		self.cancel_timer()
+		self.timer_index = self.timer_index + 1
+		self.shown_seconds = -1
+		self.start_timer()
 
 	def run(self):
-		seconds:int = int(self.get_durration_ms()/1000)
-		if 120-seconds > 0:
-			rh.display.print_str( str(120-seconds).rjust(4," "))
+		seconds:int = int(self.timer.get_remaining( time.monotonic() ) + 0.999)
+		if seconds > 0:
+			if seconds != self.shown_seconds:
+				self.shown_seconds = seconds
+				self.seconds_str = str(seconds).rjust(4," ")
+			rh.display.print_str( self.seconds_str )
 		else:
 			rh.display.print_str('done')			
-			if self.is_tune_played == False:
-				self.is_tune_played = True
-				rh.display.show() 		# display immediate because tune blocks				
-				play_tune()
+		set_rainbow_based_on_timer( self.timer )
 
-		for i in range( MAX_LEDS ):
-			rgb :list = get_countdown_color(seconds,i)
-			rh.rainbow.set_pixel(6-i, rgb[0], rgb[1], rgb[2], 0.3)
+# ----------------------------------------------------------------------------
+# A timer or alarm went off; preempts whatever mode was running until dismissed.
+class AlarmMode(Mode):
+	__slots__ = ('timer','is_tune_played')
+
+	def __init__(self):
+		Mode.__init__(self,"ALRM","Alarm")
+		self.timer :Timer = None
+		self.is_tune_played :bool = False		
+		self.set_abc_funcs( self.dismiss, self.dismiss, self.dismiss )
+
+	def enter(self, old_mode):
+		self.timer = scheduler.fired
+
+	def run(self):
+		if (int(self.get_durration_ms() / 500) % 2) == 0:
+			rh.display.print_str( self.timer.name )
+			rh.rainbow.set_all(30, 0, 0, 0.3)
+		else:
+			rh.display.print_str('done')			
+			rh.rainbow.set_all(0, 0, 0, 0.3)
+		if self.is_tune_played == False:
+			self.is_tune_played = True
+			rh.display.show() 		# display immediate because tune blocks				
+			rh.rainbow.show()
+			play_tune()
+
+	# Any button goes back to the mode that was interrupted
+	def dismiss(self):
+		buttons.lower_triggers()	# kluge: otherwise may go through to resumed mode
+		if state_machine.mode == self:
+			state_machine.resume_mode()
 
 # ----------------------------------------------------------------------------
 class StrobeMode(Mode):
+	__slots__ = ('is_tune_played',)
+
 	def __init__(self):
 		Mode.__init__(self,"Strb","Strobe")
 		self.skip_preview = False
@@ -553,17 +897,23 @@ class StrobeMode(Mode):
 
 # ----------------------------------------------------------------------------
 class CreditsMode(Mode):
+	__slots__ = ('scroll_delay','scroll_delay_max','range_words')
+
 	def __init__(self):
 		Mode.__init__(self,"CRDT","Credits")
 		self.scroll_delay = 0
 		self.scroll_delay_max = 0.25
-		self.range_words = range_sub_string( "    Made for Edward by his dad, Tronster     " ) 
+		self.range_words = None
 		self.set_abc_modes( MenuMode, MenuMode, MenuMode )
 
 	def enter(self, old_mode):
 		Mode.enter(self,old_mode)
+		self.range_words = range_sub_string( settings.credits ) 
 		rh.display.set_decimal(1, False)
 
+	def resume(self):
+		self.scroll_delay = 0			# redraw on the next frame
+
 	def run(self):
 		if self.scroll_delay <= 0:
 			self.scroll_delay = self.scroll_delay_max
@@ -577,6 +927,8 @@ class CreditsMode(Mode):
 # Count upwards on LED display and show binary representation above it on the
 # RGB leds. LEDs will use different colors for 0 and 1 for every 128 count.
 class CountMode(Mode):
+	__slots__ = ('num','update_delay','update_delay_max')
+
 	def __init__(self, led_name:str, full_name:str):
 		Mode.__init__(self,led_name,full_name)
 		self.num = -1
@@ -606,22 +958,19 @@ class CountMode(Mode):
 			return False
 		self.update_delay = self.update_delay + self.update_delay_max
 		self.num = self.num + 1
-
-		# Show binary LEDs based on string of 0 & 1s, with 0 padding & reverse w/ least significant digit first.
-		binary = f'{self.num:07b}'[::-1]
-		off_color, on_color = get_binary_colors(self.num)
-		for index,c in enumerate(binary, 0):
-			if c=="1":
-				rh.rainbow.set_pixel(index, on_color[0], on_color[1], on_color[2], 0.4)				
-			else:
-				rh.rainbow.set_pixel(index, off_color[0], off_color[1], off_color[2], 0.1)
-			index = index + 1
-			if index>=7:
-				break
+		set_rainbow_based_on_binary( self.num )
 		return True
 
+	# Redraw the current number on the next frame, without counting up
+	def resume(self):
+		if self.num >= 0:
+			self.num = self.num - 1
+		self.update_delay = 0
+
 # ----------------------------------------------------------------------------
 class CountDecimalMode(CountMode):
+	__slots__ = ()
+
 	def __init__(self):
 		super().__init__("1234","Count Decimal")
 
@@ -631,6 +980,8 @@ class CountDecimalMode(CountMode):
 
 # ----------------------------------------------------------------------------
 class CountHexMode(CountMode):
+	__slots__ = ()
+
 	def __init__(self):
 		super().__init__(" HEX","Count Hexadecimal")
 
@@ -641,6 +992,8 @@ class CountHexMode(CountMode):
 # ----------------------------------------------------------------------------
 # Pause an existing mode, passes back any properties that were set.
 class PauseMode(Mode):
+	__slots__ = ('__properties','__blink_value')
+
 	def __init__(self):
 		Mode.__init__(self,"PAUS","Pause")
 		self.__properties :list = {}
@@ -657,6 +1010,11 @@ class PauseMode(Mode):
 		old_mode_class = old_mode.__class__
 		self.set_abc_modes( old_mode_class, old_mode_class, old_mode_class )
 
+	# Put back the paused number's LEDs
+	def resume(self):
+		if self.__properties.get("num") != None and self.__properties["num"] >= 0:
+			set_rainbow_based_on_binary( self.__properties["num"] )
+
 	def run(self):
 		if (int(self.get_durration_ms() / 1000) % 2) == 0:
 			rh.display.print_str( self.__blink_value )
@@ -666,13 +1024,23 @@ class PauseMode(Mode):
 # ----------------------------------------------------------------------------
 #
 class TempatureMode(Mode):
+	__slots__ = ('is_fahrenheit','update_delay','update_delay_max')
+
 	def __init__(self):
 		Mode.__init__(self,"TEMP","Tempature")
 		self.is_fahrenheit = True
+		self.update_delay = 0
+		self.update_delay_max = 1.0		# sensors are read once a second
 		self.set_abc_funcs(None, None, self.change_tempature_scale )
 		self.set_abc_modes(None, MenuMode, None )
 
 	def run(self):
+		# Only read the sensors (which spawns vcgencmd) every second
+		if self.update_delay > 0:
+			self.update_delay = self.update_delay - state_machine.delta()
+			return
+		self.update_delay = self.update_delay + self.update_delay_max
+
 		# Obtain CPU temperature to adjust what the RainbotHAT is reading
 		res = os.popen('vcgencmd measure_temp').readline()
 		cpu_temp = int(float((res.replace("temp=","").replace("'C\n",""))))
@@ -684,65 +1052,308 @@ class TempatureMode(Mode):
 			temp = (temp * (9/5)) + 32
 		rh.display.print_float( temp )
 
+	def resume(self):
+		self.update_delay = 0			# redraw on the next frame
+
 	def change_tempature_scale(self):
 		self.is_fahrenheit = not self.is_fahrenheit
+		self.update_delay = 0			# redisplay in the new scale right away
 
 # ----------------------------------------------------------------------------
 class MenuMode(Mode):
-	modes		:list = [TempatureMode,CountDecimalMode,CountHexMode,ClockMode,NapMode,StrobeMode,CreditsMode]	# Note used: TimeoutMode
-	mode_index	:int = 0
-	last_index	:int = 0
+	__slots__ = ('last_index','preview_name')
+	mode_index	:int = 0				# Index into settings.menu_modes
 
 	def __init__(self):
 		Mode.__init__(self,"MENU","Menu")	
+		self.last_index :int = 0
+		self.preview_name :str = None
+		self.update_preview_name()
 		self.set_abc_funcs(self.func_a, self.func_b, self.func_c)
 
+	# Cache the LED name of the selected mode so run() need not create it
+	def update_preview_name(self):
+		self.preview_name = settings.menu_names[MenuMode.mode_index]
+
 	def enter(self, old_mode):
 		Mode.enter(self, old_mode)
 		rh.rainbow.set_all(1, 0, 1, 0.1)
 
+	def resume(self):
+		rh.rainbow.set_all(1, 0, 1, 0.1)
+
 	def run(self):
-		preview_mode = self.modes[MenuMode.mode_index]()				
-		rh.display.print_str( preview_mode.get_led_name() )
+		rh.display.print_str( self.preview_name )
 		brightness = 0.3 + ( 0.2 * float(int(self.get_durration_ms()/1000) % 2))
 		rh.rainbow.set_pixel((MAX_LEDS-1) - self.last_index, 1, 0, 1, 0.1 )
 		rh.rainbow.set_pixel((MAX_LEDS-1) - MenuMode.mode_index, 30, 30, 0, brightness )
 
 	# Change to selected mode
 	def func_a(self):
-		print("down: ",(MenuMode.mode_index - 1) % len(self.modes))
+		print("down: ",(MenuMode.mode_index - 1) % len(settings.menu_modes))
 		self.last_index = MenuMode.mode_index
-		MenuMode.mode_index = (MenuMode.mode_index - 1) % len(self.modes)
+		MenuMode.mode_index = (MenuMode.mode_index - 1) % len(settings.menu_modes)
+		self.update_preview_name()
 
 	# Move down a mode in the menu
 	def func_b(self):
 		buttons.lower_triggers()	# kluge: otherwise may go through to another state
-		selected_class = self.modes[MenuMode.mode_index]
-		selected_mode = selected_class()
-		print("Selected Mode: ", selected_mode.get_led_name())
+		selected_class = settings.menu_modes[MenuMode.mode_index]
+		print("Selected Mode: ", settings.menu_names[MenuMode.mode_index])
 		state_machine.change_mode( selected_class )
 
 	# Move up a mode in the menu
 	def func_c(self):
-		print("  up: ",(MenuMode.mode_index + 1) % len(self.modes))
+		print("  up: ",(MenuMode.mode_index + 1) % len(settings.menu_modes))
 		self.last_index = MenuMode.mode_index
-		MenuMode.mode_index = (MenuMode.mode_index + 1) % len(self.modes)
+		MenuMode.mode_index = (MenuMode.mode_index + 1) % len(settings.menu_modes)
+		self.update_preview_name()
 
 
 # ----------------------------------------------------------------------------
-# Main
-# Using exception so ctrl-c will cleanly break out.
-try:
-	random.seed()
-	state_machine.change_mode( StartMode )
-	while isRunning:
-		localtime = time.localtime(time.time())
-		state_machine.evalulate_buttons(buttons.trigger_a, buttons.trigger_b, buttons.trigger_c)
-		buttons.lower_triggers()
-		state_machine.run()
+#	Settings
+# ----------------------------------------------------------------------------
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "clocky.ini")
+CONFIG_POLL_S = 5.0			# How often to check the config's mtime if inotify is unavailable
+
+# Used for anything missing from the config file (or if there is no file)
+DEFAULT_CONFIG = {
+	"clock"		: { "sunrise" : "6", "sunset" : "19", "dither" : "no", "refresh_hz" : "300" },
+	"nap"		: { "minutes" : "120" },
+	"timers"	: {},
+	"credits"	: { "text" : "Made for Edward by his dad, Tronster" },
+	"menu"		: { "modes" : "TempatureMode, CountDecimalMode, CountHexMode, ClockMode, NapMode, StrobeMode, CreditsMode" },
+	"alarms"	: {},
+}
+
+# Used when the config file lists no [timers]
+DEFAULT_TIMERS = ( ("Tout", 120), )
+
+# Modes that may be listed in the [menu] section
+MENU_MODE_CLASSES = { mode_class.__name__ : mode_class for mode_class in
+	[TempatureMode,CountDecimalMode,CountHexMode,ClockMode,NapMode,StrobeMode,CreditsMode,TimeoutMode] }
+
+# Immutable, already parsed values; nothing in the render path parses or does I/O
+Settings = collections.namedtuple("Settings",
+	["sunrise","sunset","dither","refresh_delay_s","nap_ms","timers","credits","menu_modes","menu_names","alarms"])
+
+# Parse a config file into Settings; raises ValueError (or configparser.Error) if it is bad
+def load_settings( path:str ) -> Settings:
+	parser = configparser.ConfigParser(interpolation=None)		# allow % in the credits
+	parser.optionxform = str				# keep the case of alarm names
+	parser.read_dict(DEFAULT_CONFIG)
+	parser.read(path)
+
+	sunrise :int = parser.getint("clock","sunrise")
+	sunset :int = parser.getint("clock","sunset")
+	if not (0 <= sunrise < sunset <= 23):
+		raise ValueError("sunrise and sunset must be hours with sunrise before sunset")
+	refresh_hz :int = parser.getint("clock","refresh_hz")
+	if refresh_hz < 1:
+		raise ValueError("refresh_hz must be at least 1")
+	nap_minutes :int = parser.getint("nap","minutes")
+	if nap_minutes < 1:
+		raise ValueError("nap minutes must be at least 1")
+
+	menu_modes :list = []
+	for name in parser.get("menu","modes").split(","):
+		name = name.strip()
+		if name not in MENU_MODE_CLASSES:
+			raise ValueError("unknown menu mode '" + name + "'")
+		menu_modes.append( MENU_MODE_CLASSES[name] )
+	if not (0 < len(menu_modes) <= MAX_LEDS):
+		raise ValueError("menu must have 1 to " + str(MAX_LEDS) + " modes")
+
+	alarms :list = []
+	for name, value in parser.items("alarms"):
+		hour, minute = [int(n) for n in value.split(":")]
+		if not (0 <= hour <= 23 and 0 <= minute <= 59):
+			raise ValueError("alarm '" + name + "' must be HH:MM")
+		alarms.append( (name, hour, minute) )
+
+	timers :list = []
+	for name, value in parser.items("timers"):
+		seconds :int = int(value)
+		if seconds < 1:
+			raise ValueError("timer '" + name + "' must be at least 1 second")
+		timers.append( (name, seconds) )
+
+	padding :str = " " * MAX_LED_DISPLAY_WIDTH
+	return Settings(
+		sunrise		= sunrise,
+		sunset		= sunset,
+		dither		= parser.getboolean("clock","dither"),
+		refresh_delay_s = 1.0 / refresh_hz,
+		nap_ms		= nap_minutes * 60 * 1000,
+		timers		= tuple(timers) if timers else DEFAULT_TIMERS,
+		credits		= padding + parser.get("credits","text") + padding + " ",
+		menu_modes	= tuple(menu_modes),
+		menu_names	= tuple(mode_class().get_led_name() for mode_class in menu_modes),
+		alarms		= tuple(alarms))
+
+# Load the config file and swap it in whole; on error keep the current settings
+def reload_settings():
+	global settings
+	try:
+		new_settings :Settings = load_settings( CONFIG_PATH )
+	except (ValueError, configparser.Error) as e:
+		print("Config not loaded: ", e)
+		if settings == None:
+			new_settings = load_settings( os.devnull )		# fall back to defaults
+		else:
+			return
+	settings = new_settings
+	scheduler.set_alarms( settings.alarms )
+	MenuMode.mode_index = MenuMode.mode_index % len(settings.menu_modes)
+	if isinstance(state_machine.mode, MenuMode):
+		state_machine.mode.update_preview_name()
+
+# ----------------------------------------------------------------------------
+# Notices when the config file changes. Uses inotify (through libc) to watch
+# the config's directory (editors often replace the file), falling back to
+# an infrequent mtime check where inotify is not available.
+class ConfigWatcher():
+	__slots__ = ('path','fd','mtime','next_poll')
+	IN_CLOSE_WRITE	:int = 0x00000008
+	IN_MOVED_TO		:int = 0x00000080
+	IN_CREATE		:int = 0x00000100
+	IN_DELETE		:int = 0x00000200
+
+	def __init__(self, path:str):
+		self.path :str = path
+		self.fd :int = None
+		self.mtime :float = self.get_mtime()
+		self.next_poll :float = 0
+		try:
+			libc = ctypes.CDLL(None, use_errno=True)
+			fd = libc.inotify_init1(os.O_NONBLOCK)
+			mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+			if fd >= 0 and libc.inotify_add_watch(fd, os.path.dirname(path).encode(), mask) >= 0:
+				self.fd = fd
+			elif fd >= 0:
+				os.close(fd)
+		except (OSError, AttributeError):
+			pass
+		if self.fd == None:
+			print("inotify unavailable; checking config every ", CONFIG_POLL_S, " seconds")
+
+	def get_mtime(self):
+		try:
+			return os.stat(self.path).st_mtime
+		except OSError:
+			return None
+
+	# True if the file was written, replaced or removed since the last call
+	def has_changed(self) -> bool:
+		if self.fd != None:
+			has_event :bool = False
+			try:
+				while os.read(self.fd, 4096):		# drain; events may be for other files
+					has_event = True
+			except BlockingIOError:
+				pass
+			if not has_event:
+				return False
+		else:
+			now = time.monotonic()
+			if now < self.next_poll:
+				return False
+			self.next_poll = now + CONFIG_POLL_S
+		mtime = self.get_mtime()
+		if mtime == self.mtime:
+			return False
+		self.mtime = mtime
+		return True
+
+
+# ----------------------------------------------------------------------------
+# One frame of the main loop, everything except sleeping until the next one.
+# Returns time.monotonic() at the end of the frame.
+def run_frame() -> float:
+	global localtime, localtime_sec, ms_now, display_due
+	# Only build a new struct_time when the second changes
+	ms_now = time.time()
+	if localtime == None or int(ms_now) != localtime_sec:
+		localtime_sec = int(ms_now)
+		localtime = time.localtime(ms_now)
+		if config_watcher != None and config_watcher.has_changed():		# swap in new settings between frames
+			reload_settings()
+	state_machine.evalulate_buttons(buttons.trigger_a, buttons.trigger_b, buttons.trigger_c)
+	buttons.lower_triggers()
+	now = time.monotonic()
+	if (now >= scheduler.next_due or ms_now >= scheduler.next_alarm_due) and scheduler.fire_due(now, ms_now):
+		state_machine.preempt_mode( AlarmMode )		# a timer or alarm went off
+	state_machine.run()
+	rh.rainbow.show()		
+	now = time.monotonic()
+	if now >= display_due:
+		display_due = now + FRAME_DELAY_S
 		rh.lights.rgb(buttons.led_a, buttons.led_b, buttons.led_c)
 		rh.display.show()
-		rh.rainbow.show()		
-		time.sleep(0.01)
-except KeyboardInterrupt:
-	pass
+	return now
+
+
+# ----------------------------------------------------------------------------
+# Benchmark ( python3 clocky.py --benchmark )
+# Runs full clock mode frames (run_frame(), with dithering on) as fast as it
+# can and reports whether every frame fits in the 1/refresh_hz budget, not
+# just whether the average rate is high enough. Returns True if it kept up.
+BENCHMARK_MAX_OVER_BUDGET = 0.01		# Share of frames allowed over budget to count as sustained
+
+def run_benchmark( seconds:float = 5.0 ) -> bool:
+	global settings
+	settings = settings._replace(dither=True)
+	state_machine.change_mode( ClockMode )
+	budget_s :float = settings.refresh_delay_s
+	frames :int = 0
+	over_budget :int = 0
+	worst_s :float = 0
+	start :float = time.monotonic()
+	end :float = start + seconds
+	now :float = start
+	while now < end:
+		frame_start :float = now
+		now = run_frame()
+		frame_s :float = now - frame_start
+		worst_s = max(worst_s, frame_s)
+		if frame_s > budget_s:
+			over_budget += 1
+		frames += 1
+	target_hz :float = 1.0 / budget_s
+	hz :float = frames / (now - start)
+	over_share :float = over_budget / frames
+	is_sustained :bool = hz >= target_hz and over_share <= BENCHMARK_MAX_OVER_BUDGET
+	print("Benchmark: ", frames, " frames in ", round(now - start, 2), "s = ", round(hz, 1), " Hz",
+		"  (slowest frame ", round(worst_s * 1000, 2), "ms)")
+	print("Over the ", round(budget_s * 1000, 2), "ms budget: ", over_budget, " frames (",
+		round(over_share * 100, 2), "%, at most ", BENCHMARK_MAX_OVER_BUDGET * 100, "% allowed)")
+	print("Target:    ", round(target_hz, 1), " Hz ", "OK" if is_sustained else "TOO SLOW")
+	return is_sustained
+
+
+# ----------------------------------------------------------------------------
+# Main
+# Using exception so ctrl-c will cleanly break out.
+if __name__ == "__main__":
+	try:
+		random.seed()
+		config_watcher = ConfigWatcher( CONFIG_PATH )
+		reload_settings()
+		if "--benchmark" in sys.argv:
+			isRunning = False
+			if not run_benchmark():
+				sys.exit(1)						# let scripts see the Pi is too slow to dither
+		else:
+			state_machine.change_mode( StartMode )
+		frame_due :float = time.monotonic()		# when the next frame should start
+		while isRunning:
+			now = run_frame()
+			# Sleep until the next frame; if running behind, don't try to catch up
+			frame_due = frame_due + state_machine.mode.get_frame_delay_s()
+			if frame_due > now + MIN_FRAME_SLEEP_S:
+				time.sleep(frame_due - now)
+			else:
+				frame_due = now + MIN_FRAME_SLEEP_S
+				time.sleep(MIN_FRAME_SLEEP_S)
+	except KeyboardInterrupt:
+		pass
@@ -0,0 +1,334 @@
+# ============================================================================
+# Tests for clocky.py, run off device with a stand-in for the rainbowhat module.
+#	python3 -m pytest tests
+# ============================================================================
+import gc
+import os
+import sys
+import time
+import tracemalloc
+import types
+
+import pytest
+
+
+# ----------------------------------------------------------------------------
+# Minimal stand-in for the RainbowHAT library; just enough for clocky to run.
+class _Touch():
+	def press(self):	return lambda func: func
+	def release(self):	return lambda func: func
+
+class _Display():
+	def set_digit_raw(self, index, bitmask):	pass
+	def print_str(self, text):					pass
+	def print_float(self, value):				pass
+	def set_decimal(self, index, state):		pass
+	def show(self):								pass
+
+class _Rainbow():
+	def set_pixel(self, x, r, g, b, brightness=None):	pass
+	def set_all(self, r, g, b, brightness=None):		pass
+	def show(self):										pass
+
+def _make_rainbowhat():
+	rh = types.ModuleType("rainbowhat")
+	rh.touch	= types.SimpleNamespace(A=_Touch(), B=_Touch(), C=_Touch())
+	rh.display	= _Display()
+	rh.rainbow	= _Rainbow()
+	rh.buzzer	= types.SimpleNamespace(midi_note=lambda note, durration: None)
+	rh.lights	= types.SimpleNamespace(rgb=lambda r, g, b: None)
+	rh.weather	= types.SimpleNamespace(temperature=lambda: 30.0)
+	return rh
+
+sys.modules.setdefault("rainbowhat", _make_rainbowhat())
+
+# Trace from before clocky is imported, and push floats made before tracing out
+# of the float free list; otherwise reused untraced floats show up as noise.
+tracemalloc.start()
+_floats = [float(i) for i in range(1000)]
+del _floats
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import clocky		# pylint: disable=wrong-import-position
+
+
+# ----------------------------------------------------------------------------
+# Deterministic clock so every run does the same work: each call moves 1 ms on.
+# monotonic() is bound once, so like the real module's functions (and unlike a
+# method) calling it does not allocate.
+class FakeTime():
+	def __init__(self):
+		self.now :float = 1000.0
+		self.epoch :float = time.mktime((2022,10,1,22,30,0,0,0,-1))
+		self.monotonic = self.get_monotonic
+	def get_monotonic(self):
+		self.now += 0.001
+		return self.now
+	def time(self):						return self.epoch
+	def localtime(self, seconds=None):	return time.localtime(self.epoch if seconds == None else seconds)
+	def mktime(self, value):			return time.mktime(value)
+	def sleep(self, seconds):			pass
+
+WARMUP_FRAMES	= 1000
+MEASURE_FRAMES	= 5000
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+	fake_time = FakeTime()
+	monkeypatch.setattr(clocky, "time", fake_time)
+	clocky.reload_settings()
+	monkeypatch.setattr(clocky, "scheduler", clocky.Scheduler())
+	monkeypatch.setattr(clocky, "state_machine", clocky.StateMachine())
+	monkeypatch.setattr(clocky, "localtime", fake_time.localtime())
+	yield
+
+def run_frames(count:int):
+	for i in range(count):
+		clocky.state_machine.run()
+
+def run_main_loop_frames(count:int):
+	for i in range(count):
+		clocky.run_frame()
+
+# Most bytes a warmed up mode's frames had allocated at once, above what was in
+# use before them; short lived objects count, not only what is kept. gc is off
+# while measuring since a full collection empties CPython's free lists, which
+# then refill from (traced) memory.
+def get_frame_allocation(mode_class, run=run_frames) -> int:
+	clocky.state_machine.change_mode( mode_class )
+	clocky.state_machine.force_skip_preview = True
+	gc.collect()
+	gc.disable()
+	try:
+		run(WARMUP_FRAMES)
+		before = tracemalloc.get_traced_memory()[0]
+		tracemalloc.reset_peak()
+		run(MEASURE_FRAMES)
+		return tracemalloc.get_traced_memory()[1] - before
+	finally:
+		gc.enable()
+
+# Python itself makes a few small objects during a frame (loop iterators, ints
+# over 256, 'before' above) and a string when a display changes; those fit.
+# A list of pixels built each frame, or anything kept frame to frame, does not.
+FRAME_SCRATCH_BYTES = 384
+
+# StartMode is left out: it plays its animation once, then changes to ClockMode.
+@pytest.mark.parametrize("mode_name", [
+	"ClockMode", "NapMode", "TimeoutMode", "StrobeMode", "CreditsMode",
+	"CountDecimalMode", "CountHexMode", "MenuMode" ])
+def test_mode_frames_do_not_allocate(mode_name):
+	assert get_frame_allocation( getattr(clocky, mode_name) ) <= FRAME_SCRATCH_BYTES
+
+def test_pause_mode_frames_do_not_allocate():
+	clocky.state_machine.change_mode( clocky.CountDecimalMode )	# pause needs a number
+	run_frames(1)
+	assert get_frame_allocation( clocky.PauseMode ) <= FRAME_SCRATCH_BYTES
+
+def test_alarm_mode_frames_do_not_allocate():
+	clocky.scheduler.add_timer("Tout", 0)
+	assert clocky.scheduler.fire_due(clocky.time.monotonic(), clocky.time.time())
+	assert get_frame_allocation( clocky.AlarmMode ) <= FRAME_SCRATCH_BYTES
+
+def test_tempature_mode_frames_do_not_allocate(monkeypatch):
+	vcgencmd = types.SimpleNamespace(readline=lambda: "temp=40.0'C\n")
+	monkeypatch.setattr(clocky.os, "popen", lambda command: vcgencmd)
+	assert get_frame_allocation( clocky.TempatureMode ) <= FRAME_SCRATCH_BYTES
+
+def test_dithered_clock_main_loop_frames_do_not_allocate(monkeypatch):
+	monkeypatch.setattr(clocky, "settings", clocky.settings._replace(dither=True))
+	assert get_frame_allocation( clocky.ClockMode, run_main_loop_frames ) <= FRAME_SCRATCH_BYTES
+
+def test_clock_with_timer_frames_do_not_allocate():
+	clocky.scheduler.add_timer("Tout", 120)
+	assert get_frame_allocation( clocky.ClockMode ) <= FRAME_SCRATCH_BYTES
+
+# The check must see temporary lists too, not only memory that is kept
+def test_frame_allocation_sees_a_list_made_every_frame(monkeypatch):
+	get_sin_shine = clocky.get_sin_shine
+	def get_sin_shine_with_list(i, sec, out):
+		scratch = [0] * 64
+		return get_sin_shine(i, sec, out)
+	monkeypatch.setattr(clocky, "get_sin_shine", get_sin_shine_with_list)
+	assert get_frame_allocation( clocky.ClockMode ) > FRAME_SCRATCH_BYTES
+
+
+# ----------------------------------------------------------------------------
+#	Scheduler
+DAY_S = 24*60*60
+
+def test_timer_fires_when_due():
+	scheduler = clocky.Scheduler()
+	timer = scheduler.add_timer("Tout", 120)
+	assert not scheduler.fire_due(timer.due - 1, clocky.time.time())
+	assert scheduler.fire_due(timer.due, clocky.time.time())
+	assert scheduler.fired is timer
+	assert len(scheduler) == 0
+
+def test_alarm_fires_once_and_rearms_from_its_own_due_time():
+	scheduler = clocky.Scheduler()
+	alarm = scheduler.add_alarm("WAKE", 7, 0)
+	assert time.localtime(alarm.due)[3:5] == (7, 0)
+	assert scheduler.fire_due(clocky.time.monotonic(), alarm.due)
+	assert scheduler.fired is alarm
+	# Not again a second later; next one is the following day at 7:00
+	assert not scheduler.fire_due(clocky.time.monotonic(), alarm.due + 1)
+	assert scheduler.next_alarm_due == clocky.get_next_alarm_time(7, 0, alarm.due)
+	assert abs(scheduler.next_alarm_due - alarm.due - DAY_S) <= 60*60
+
+def test_alarm_skipped_over_by_clock_change_does_not_sound():
+	scheduler = clocky.Scheduler()
+	alarm = scheduler.add_alarm("WAKE", 7, 0)
+	now_epoch = alarm.due + (3 * DAY_S) + 60*60		# clock set days ahead (e.g. NTP at boot)
+	assert not scheduler.fire_due(clocky.time.monotonic(), now_epoch)
+	assert now_epoch < scheduler.next_alarm_due <= now_epoch + DAY_S
+
+def test_cancelled_timer_does_not_fire():
+	scheduler = clocky.Scheduler()
+	tea = scheduler.add_timer("TEA", 60)
+	egg = scheduler.add_timer("EGG", 120)
+	assert scheduler.cancel(tea)
+	assert scheduler.next_due == egg.due
+	assert not scheduler.fire_due(tea.due, clocky.time.time())
+	assert not scheduler.cancel(tea)
+	assert len(scheduler) == 1
+
+def test_timeout_mode_buttons_cancel_and_switch_timers(monkeypatch):
+	monkeypatch.setattr(clocky, "settings", clocky.settings._replace(timers=(("TEA",240),("EGG",420))))
+	clocky.state_machine.change_mode( clocky.TimeoutMode )
+	assert clocky.scheduler.soonest().name == "TEA"
+	clocky.state_machine.evalulate_buttons(False, False, True)		# C: next timer
+	assert clocky.scheduler.soonest().name == "EGG"
+	assert len(clocky.scheduler) == 1
+	clocky.state_machine.evalulate_buttons(True, False, False)		# A: cancel
+	assert len(clocky.scheduler) == 0
+	assert isinstance(clocky.state_machine.mode, clocky.ClockMode)
+
+def test_dismissed_alarm_resumes_mode_and_redraws(monkeypatch):
+	shown = []
+	monkeypatch.setattr(clocky.rh.display, "print_str", shown.append)
+	clocky.state_machine.change_mode( clocky.CountDecimalMode )
+	clocky.state_machine.force_skip_preview = True
+	clocky.state_machine.run()
+	assert shown[-1] == "   0"
+
+	clocky.scheduler.add_timer("Tout", 0)
+	assert clocky.scheduler.fire_due(clocky.time.monotonic(), clocky.time.time())
+	clocky.state_machine.preempt_mode( clocky.AlarmMode )
+	clocky.state_machine.run()
+	assert shown[-1] == "Tout"
+
+	clocky.state_machine.mode.dismiss()
+	clocky.state_machine.run()
+	assert isinstance(clocky.state_machine.mode, clocky.CountDecimalMode)
+	assert shown[-1] == "   0"
+
+
+# ----------------------------------------------------------------------------
+#	Settings
+def write_config(tmp_path, text:str) -> str:
+	path = tmp_path / "clocky.ini"
+	path.write_text(text)
+	return str(path)
+
+def test_credits_may_contain_percent(tmp_path):
+	settings = clocky.load_settings( write_config(tmp_path, "[credits]\ntext = 100% Dad\n") )
+	assert settings.credits.strip() == "100% Dad"
+
+def test_timers_keep_their_names_and_order(tmp_path):
+	settings = clocky.load_settings( write_config(tmp_path, "[timers]\nTEA = 240\nEGG = 420\n") )
+	assert settings.timers == (("TEA",240), ("EGG",420))
+	assert clocky.load_settings( write_config(tmp_path, "") ).timers == clocky.DEFAULT_TIMERS
+
+@pytest.mark.parametrize("text", [
+	"[nap]\nminutes = 0\n",
+	"[timers]\nTout = -5\n",
+	"[clock]\nrefresh_hz = 0\n",
+	"[menu]\nmodes = Bogus\n" ])
+def test_bad_settings_are_rejected(tmp_path, text):
+	with pytest.raises(ValueError):
+		clocky.load_settings( write_config(tmp_path, text) )
+
+@pytest.mark.parametrize("text", [ "[nap]\nminutes = 0\n", "minutes = 5\n" ])
+def test_bad_config_keeps_previous_settings(tmp_path, monkeypatch, text):
+	monkeypatch.setattr(clocky, "CONFIG_PATH", write_config(tmp_path, "[nap]\nminutes = 5\n"))
+	clocky.reload_settings()
+	assert clocky.settings.nap_ms == 5 * 60 * 1000
+	previous = clocky.settings
+	write_config(tmp_path, text)
+	clocky.reload_settings()
+	assert clocky.settings is previous
+
+# Set a file's mtime so changes are seen whatever the file system's resolution
+def set_mtime(path, mtime:float):
+	os.utime(path, (mtime, mtime))
+
+def test_config_watcher_sees_write_and_atomic_replace(tmp_path):
+	path = write_config(tmp_path, "[nap]\nminutes = 5\n")
+	set_mtime(path, 1000)
+	watcher = clocky.ConfigWatcher(path)
+	if watcher.fd == None:
+		pytest.skip("inotify is not available")
+	try:
+		assert not watcher.has_changed()
+		write_config(tmp_path, "[nap]\nminutes = 6\n")
+		set_mtime(path, 2000)
+		assert watcher.has_changed()
+		assert not watcher.has_changed()
+
+		replacement = tmp_path / "clocky.ini.new"		# how many editors save
+		replacement.write_text("[nap]\nminutes = 7\n")
+		set_mtime(replacement, 3000)
+		assert not watcher.has_changed()			# only the other file so far
+		os.replace(replacement, path)
+		assert watcher.has_changed()
+	finally:
+		os.close(watcher.fd)
+
+def test_config_watcher_checks_mtime_without_inotify(tmp_path):
+	path = write_config(tmp_path, "[nap]\nminutes = 5\n")
+	set_mtime(path, 1000)
+	watcher = clocky.ConfigWatcher(path)
+	if watcher.fd != None:
+		os.close(watcher.fd)
+		watcher.fd = None
+	assert not watcher.has_changed()
+	set_mtime(path, 2000)
+	assert not watcher.has_changed()			# not checked again until CONFIG_POLL_S later
+	clocky.time.now += clocky.CONFIG_POLL_S
+	assert watcher.has_changed()
+
+
+# ----------------------------------------------------------------------------
+#	Frame rate
+def test_clock_refreshes_fast_only_while_dithering(monkeypatch):
+	mode = clocky.ClockMode()
+	monkeypatch.setattr(clocky, "settings", clocky.settings._replace(dither=True))
+	assert mode.get_frame_delay_s() == clocky.settings.refresh_delay_s
+	clocky.scheduler.add_timer("Tout", 120)
+	assert mode.get_frame_delay_s() == clocky.FRAME_DELAY_S
+	monkeypatch.setattr(clocky, "scheduler", clocky.Scheduler())
+	monkeypatch.setattr(clocky, "settings", clocky.settings._replace(dither=False))
+	assert mode.get_frame_delay_s() == clocky.FRAME_DELAY_S
+
+def test_dither_averages_to_the_exact_color(monkeypatch):
+	shown = []
+	monkeypatch.setattr(clocky.rh.rainbow, "set_pixel", lambda *pixel: shown.append(pixel))
+	frames = 1000
+	dither = clocky.DitherBuffer(1)
+	dither.set_pixel(0, 2.25, 0.5, 9.9, 0.1)
+	for i in range(frames):
+		dither.show(True)
+	for channel, value in ((1, 2.25), (2, 0.5), (3, 9.9)):
+		outputs = [pixel[channel] for pixel in shown]
+		assert set(outputs) == {int(value), int(value) + 1}
+		assert sum(outputs) / frames == pytest.approx(value, abs=1/frames)
+
+	shown.clear()
+	dither.show(False)
+	assert shown == [(0, 2.25, 0.5, 9.9, 0.1)]
+
+def test_benchmark_reports_if_refresh_rate_is_kept_up(monkeypatch):
+	monkeypatch.setattr(clocky, "settings", clocky.settings._replace(refresh_delay_s=1.0))
+	assert clocky.run_benchmark(0.1)
+	monkeypatch.setattr(clocky, "settings", clocky.settings._replace(refresh_delay_s=0.000001))
+	assert not clocky.run_benchmark(0.1)